@@ -1,27 +1,68 @@
+import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-import json
+import orjson
 import random
 import logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
-from bs4 import BeautifulSoup
-from urllib.parse import quote_plus, urlencode
+from flask.json.provider import JSONProvider
+from selectolax.lexbor import LexborHTMLParser
+from urllib.parse import quote_plus, urlsplit
 import re
+import hashlib
+import itertools
+import threading
+import redis
+from cachetools import TLRUCache
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.exceptions import NoSuchJobError
 from flask_cors import CORS
+from flask_compress import Compress
 
 # Set up logging
+# Records are written straight to stderr: under the gevent workers a QueueListener "thread" would only be
+# another greenlet doing the same blocking write, so a queue in between buys nothing.
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     # Consider logging to stdout/stderr for Render.com to pick up logs easily
-    # filename='flight_scraper.log' 
-    handlers=[logging.StreamHandler()] 
+    # (swap in logging.FileHandler('flight_scraper.log') to log to a file instead)
+    handlers=[logging.StreamHandler()]
 )
 logger = logging.getLogger('flight_scraper')
 
+class OrjsonProvider(JSONProvider):
+    """Serialize jsonify() responses with orjson, which encodes straight to bytes in C."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+CORS(app, expose_headers=['X-Cache'])
+
+# Compress JSON responses; flight lists shrink several-fold and small error bodies are left alone
+app.config.update(
+    COMPRESS_ALGORITHM=['br', 'gzip'],
+    COMPRESS_MIN_SIZE=1024,
+    COMPRESS_LEVEL=4, # gzip
+    COMPRESS_BR_LEVEL=4,
+)
+Compress(app)
 
 # Configuration
 GOOGLE_FLIGHTS_BASE_URL = "https://www.google.com/travel/flights" # Ensure this is the correct base
@@ -32,43 +73,194 @@ USER_AGENTS = [
 ]
 
 # Rate limiting settings
-MIN_WAIT_TIME = 7  # Increased slightly
-MAX_WAIT_TIME = 15 # Increased slightly
+# Requests go out immediately while budget is available and only wait once the hourly budget is spent.
 MAX_REQUESTS_PER_HOUR = 15 # Reduced slightly to be more cautious
 
-request_timestamps = []
-
-def enforce_rate_limit():
-    global request_timestamps
-    current_time = time.time()
-    request_timestamps = [ts for ts in request_timestamps if current_time - ts < 3600]
-    
-    if len(request_timestamps) >= MAX_REQUESTS_PER_HOUR:
-        sleep_time = 3600 - (current_time - request_timestamps[0]) + random.uniform(1, 60) # Add jitter
-        logger.warning(f"Hourly rate limit reached ({MAX_REQUESTS_PER_HOUR}/hr). Sleeping for {sleep_time:.2f} seconds.")
+# HTTP connection pooling settings
+# Every scrape targets the same host, so a shared Session keeps the TCP/TLS connection alive between requests.
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 20
+# Retry connection errors and transient gateway errors. 429s are not retried (that would only dig the block deeper),
+# and raise_on_status=False hands the last response back so raise_for_status() still reports the HTTP status.
+MAX_RETRIES = Retry(total=2, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False)
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=MAX_RETRIES))
+
+# Response cache settings
+# Successful results are cached in-process first; when REDIS_URL is set (e.g. redis://localhost:6379/0)
+# they are also shared across workers through Redis, which briefly caches errors as well.
+REDIS_URL = os.environ.get('REDIS_URL')
+CACHE_TTL = 600 # Seconds a successful scrape result is served from cache
+CACHE_MAX_ENTRIES = 1024 # Per-process cache size
+ERROR_CACHE_TTL = 30 # Keep errors (e.g. a transient 429 block) only briefly so they don't poison the cache
+
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# Entries are (expires_at, result) on the time.monotonic() clock, so a result copied in from Redis
+# keeps only the TTL it had left there instead of starting a fresh CACHE_TTL
+result_cache = TLRUCache(maxsize=CACHE_MAX_ENTRIES, ttu=lambda key, entry, now: entry[0])
+result_cache_lock = threading.Lock() # TLRUCache is not thread-safe
+
+# Parsed-page cache settings
+# Byte-identical responses (e.g. the same route fetched twice) reuse the flights parsed the first time.
+# Entries are keyed on a hash of the response body, in-process first and then in Redis (if configured).
+PARSE_CACHE_SIZE = 256
+PARSE_CACHE_TTL = 300 # Seconds
+
+parse_cache = OrderedDict()
+parse_cache_lock = threading.Lock()
+
+# Background job settings
+# Off by default: /api/search answers with flights synchronously. With BACKGROUND_JOBS=1 (and REDIS_URL set),
+# cache misses return 202 with a job_id instead and are scraped by an RQ worker (the worker service in render.txt):
+#   rq worker flights --url $REDIS_URL
+# RQ stores pickled payloads, so the queue gets its own connection without decode_responses.
+BACKGROUND_JOBS = os.environ.get('BACKGROUND_JOBS') == '1'
+JOB_QUEUE_NAME = 'flights'
+JOB_TIMEOUT = 3600 + 300 # A job may have to wait out the full hourly rate-limit window
+job_queue = Queue(JOB_QUEUE_NAME, connection=redis.Redis.from_url(REDIS_URL)) if REDIS_URL and BACKGROUND_JOBS else None
+
+# Batch search settings
+MAX_BATCH_QUERIES = 8
+BATCH_MAX_WORKERS = 8 # Scrapes in a batch run concurrently and share SESSION's connection pool
+
+# Response bodies are streamed in chunks of this size and handed to the parser as raw bytes
+RESPONSE_CHUNK_SIZE = 65536
+MAX_RESPONSE_BYTES = 4_000_000 # Anything past this is dropped rather than buffered
+
+# Extraction selectors and patterns (see the SELECTOR WARNING in extract_flight_data)
+# Defined once here so the per-container loop doesn't rebuild them for every flight card.
+FLIGHT_CONTAINER_SELECTOR = 'div[jscontroller][role="listitem"], li[data-flight-id]' # Example, try to find unique attributes
+TIME_SELECTOR = 'span[aria-hidden="true"]' # This is a common pattern for visible text
+
+# Each field is read from the first element in the container matching one of its (tags, attribute, text) rules,
+# i.e. the CSS selector :is(tags)[attribute*="text"]. All rules are combined into FIELD_SELECTOR so each container
+# is queried once, and the matched elements are dispatched to their fields in document order.
+FIELD_RULES = (
+    ('airline', ('div',), 'aria-label', 'airline'),
+    ('airline', ('span',), 'class', 'carrier'),
+    ('airline', ('div',), 'class', 'airline'),
+    ('airline_img', ('img',), 'alt', 'airline'),
+    ('airline_img', ('img',), 'aria-label', 'airline'),
+    ('departs', ('div', 'span'), 'aria-label', 'Departs at'),
+    ('arrives', ('div', 'span'), 'aria-label', 'Arrives at'),
+    ('duration', ('div', 'span'), 'aria-label', 'duration'),
+    ('stops', ('div', 'span'), 'aria-label', 'stop'),
+    ('stops', ('span',), 'class', 'stops'),
+    ('price', ('div', 'span'), 'aria-label', '$'),
+    ('price', ('div',), 'class', 'price'),
+)
+FIELD_SELECTOR = ', '.join([TIME_SELECTOR] + [
+    f'{tags[0] if len(tags) == 1 else ":is(" + ", ".join(tags) + ")"}[{attribute}*="{text}"]'
+    for _, tags, attribute, text in FIELD_RULES
+])
+
+# Byte markers of flight containers, used to trim the page before parsing. The trimmed region starts at the tag
+# holding the first marker and ends at the first <script> after the last one, however long the last card is.
+FLIGHT_CONTAINER_MARKERS = (b'role="listitem"', b'data-flight-id')
+# Looser markers (any attribute quoting) that every page with flight results contains; CAPTCHA and consent pages don't
+FLIGHT_PAGE_MARKERS = (b'listitem', b'data-flight-id')
+TIME_RE = re.compile(r'^\d{1,2}:\d{2}\s*(?:AM|PM)?$') # A span whose whole text is a time
+TIME_EXTRACT_RE = re.compile(r'(\d{1,2}:\d{2}\s*(?:AM|PM)?)') # A time inside e.g. "Departs at 8:05 AM"
+DURATION_RE = re.compile(r'(\d+h\s*\d*m?)')
+STOPS_RE = re.compile(r'(\d+)\s*stop(s)?')
+PRICE_RE = re.compile(r'\$(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)')
+DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}') # API dates are passed into the search query as-is
+
+# Requests to each host are limited by a token bucket that holds up to MAX_REQUESTS_PER_HOUR tokens
+# and refills at MAX_REQUESTS_PER_HOUR per hour.
+RATE_LIMIT_WINDOW = 3600 # Seconds
+RATE_LIMIT_REFILL_RATE = MAX_REQUESTS_PER_HOUR / RATE_LIMIT_WINDOW # Tokens per second
+RATE_LIMIT_KEY = 'flights:rate_bucket' # Suffixed with the target host
+
+# Bucket shared by all workers, stored as a hash of {tokens, ts} and updated atomically.
+# Takes a token and returns 0 if one is available, otherwise the seconds until the next one.
+# Floats go through tostring(), since Redis truncates Lua numbers to integers.
+RATE_LIMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local rate = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate))
+return tostring(wait)
+"""
+
+rate_limit_script = redis_client.register_script(RATE_LIMIT_SCRIPT) if redis_client else None
+
+# Per-process fallback used when Redis is not configured or unreachable. host -> [tokens, last_refill]
+token_buckets = {}
+token_buckets_lock = threading.Lock() # Batch searches acquire slots from several threads
+
+def acquire_local_rate_limit_slot(host):
+    with token_buckets_lock:
+        now = time.monotonic()
+        bucket = token_buckets.setdefault(host, [MAX_REQUESTS_PER_HOUR, now])
+        tokens = min(MAX_REQUESTS_PER_HOUR, bucket[0] + (now - bucket[1]) * RATE_LIMIT_REFILL_RATE)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0
+        bucket[0] = tokens
+        return (1 - tokens) / RATE_LIMIT_REFILL_RATE
+
+def acquire_rate_limit_slot(host):
+    if rate_limit_script is None:
+        return acquire_local_rate_limit_slot(host)
+    now = time.time()
+    try:
+        return float(rate_limit_script(keys=[f"{RATE_LIMIT_KEY}:{host}"], args=[now, MAX_REQUESTS_PER_HOUR, RATE_LIMIT_REFILL_RATE]))
+    except redis.RedisError as e:
+        logger.warning("Redis rate limiter unavailable, falling back to per-process limit: %s", e)
+        return acquire_local_rate_limit_slot(host)
+
+def enforce_rate_limit(host):
+    wait_time = acquire_rate_limit_slot(host)
+    while wait_time > 0:
+        sleep_time = wait_time + random.uniform(1, 60) # Add jitter
+        logger.warning("Hourly rate limit reached (%s/hr) for %s. Sleeping for %.2f seconds.", MAX_REQUESTS_PER_HOUR, host, sleep_time)
         time.sleep(sleep_time)
-        request_timestamps = [ts for ts in request_timestamps if time.time() - ts < 3600] # Re-check after sleep
-    
-    sleep_duration = random.uniform(MIN_WAIT_TIME, MAX_WAIT_TIME)
-    logger.info(f"Rate limiting: sleeping for {sleep_duration:.2f} seconds before request.")
-    time.sleep(sleep_duration)
-    request_timestamps.append(time.time())
+        wait_time = acquire_rate_limit_slot(host) # Re-check after sleep
+
+# Static request headers; only the User-Agent changes per request
+BASE_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br', # Exactly what the Chrome 90-92 USER_AGENTS send; urllib3 decodes br via brotli
+    'DNT': '1', # Do Not Track
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none', # Was 'same-origin' if directly navigating on Google, 'none' for initial
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'no-cache', # Be explicit about not wanting cached results
+    'Pragma': 'no-cache'
+}
+SESSION.headers.update(BASE_HEADERS) # Set once on the session; get_headers() only supplies the rotating User-Agent
+
+# Round-robin User-Agent rotation; next() on an itertools.cycle is atomic under the GIL.
+# Shuffled per process so workers start at different User-Agents, including workers forked from a --preload master.
+def shuffle_user_agents():
+    global USER_AGENT_CYCLE
+    USER_AGENT_CYCLE = itertools.cycle(random.sample(USER_AGENTS, len(USER_AGENTS)))
+
+shuffle_user_agents()
+os.register_at_fork(after_in_child=shuffle_user_agents)
 
 def get_headers():
-    return {
-        'User-Agent': random.choice(USER_AGENTS),
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'DNT': '1', # Do Not Track
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none', # Was 'same-origin' if directly navigating on Google, 'none' for initial
-        'Sec-Fetch-User': '?1',
-        'Cache-Control': 'no-cache', # Be explicit about not wanting cached results
-        'Pragma': 'no-cache'
-    }
+    return {'User-Agent': next(USER_AGENT_CYCLE)}
 
+@lru_cache(maxsize=4096) # Identical queries repeat constantly; only log and build on a miss
 def build_search_url(origin, destination, date_str, return_date_str=None, adults=1):
     """
     Build the Google Flights search URL.
@@ -83,21 +275,18 @@ def build_search_url(origin, destination, date_str, return_date_str=None, adults
     # Using query parameters:
     # This will likely take you to a search results page that then might do its own internal fetches.
     # It's less direct than knowing the deep-link structure.
-    params = {
-        'hl': 'en',
-        # The 'q' parameter is for general, human-readable search queries.
-        # For structured data, this is less reliable than specific flight parameters.
-        'q': f"flights from {origin} to {destination} on {date_str}"
-    }
+    # The 'q' parameter is for general, human-readable search queries.
+    # For structured data, this is less reliable than specific flight parameters.
+    query = f"flights from {origin} to {destination} on {date_str}"
     if adults > 1:
-      params['q'] += f" for {adults} adults"
+      query += f" for {adults} adults"
 
     # For one-way, only departure date is needed in 'q'
     # For round-trip, Google often uses a different structure or encodes both dates.
     # If your `return_date_str` is provided, you might append "returning {return_date_str}" to q,
     # or use specific date parameters if you discover them.
     if return_date_str:
-        params['q'] += f" returning {return_date_str}"
+        query += f" returning {return_date_str}"
         # Google might also use separate date fields in some URL formats e.g., d1=YYYY-MM-DD&d2=YYYY-MM-DD
 
     # The 'tfs' parameter you had before is extremely specific and usually generated by Google's UI.
@@ -107,17 +296,64 @@ def build_search_url(origin, destination, date_str, return_date_str=None, adults
     # Constructing the URL
     # Google Flights uses a path often like /travel/flights/search or just /flights
     # For example: https://www.google.com/flights/search?hl=en&q=flights+from+JFK+to+LAX+on+2024-12-01
-    url = f"{GOOGLE_FLIGHTS_BASE_URL}/search?{urlencode(params)}"
-    logger.info(f"Built Google Flights Search URL: {url}")
+    # Only q carries user input, so it is the only part that needs quoting.
+    url = f"{GOOGLE_FLIGHTS_BASE_URL}/search?hl=en&q={quote_plus(query)}"
+    logger.debug("Built Google Flights Search URL: %s", url)
     return url
 
-def extract_flight_data(html_content, origin, destination, date_str):
+def trim_to_flight_list(html_content):
+    """
+    Slice the page down to the region holding the flight containers, so the parser skips the inline
+    scripts and styles that make up most of a Google Flights page. Returns the full page if no marker is found.
+    Both cuts fall on a '<', so they never split a tag or a multi-byte character. Flight cards hold no
+    inline scripts, so the first <script> after the last card's opening tag is past the end of that card.
     """
-    Extract flight information from the HTML content.
+    starts = [pos for pos in (html_content.find(marker) for marker in FLIGHT_CONTAINER_MARKERS) if pos != -1]
+    if not starts:
+        return html_content
+    start = max(0, html_content.rfind(b'<', 0, min(starts)))
+    end = html_content.find(b'<script', max(html_content.rfind(marker) for marker in FLIGHT_CONTAINER_MARKERS))
+    return html_content[start:end] if end != -1 else html_content[start:]
+
+def find_field_elements(container):
+    """
+    Query the container once with FIELD_SELECTOR.
+    Returns (fields, field_attributes, time_elements): the first matching element per field name, that element's
+    attributes (read once here, since selectolax rebuilds the dict on every .attributes access), and all TIME_SELECTOR spans.
+    """
+    fields = {}
+    field_attributes = {}
+    time_elements = []
+    seen = set()
+    for node in container.css(FIELD_SELECTOR):
+        if node.mem_id in seen: # Lexbor yields an element once per selector it matches
+            continue
+        seen.add(node.mem_id)
+        tag = node.tag
+        attributes = node.attributes
+        if tag == 'span' and attributes.get('aria-hidden') == 'true':
+            time_elements.append(node)
+        for field, rule_tags, attribute, text in FIELD_RULES:
+            if field not in fields and tag in rule_tags and text in (attributes.get(attribute) or ''):
+                fields[field] = node
+                field_attributes[field] = attributes
+    return fields, field_attributes, time_elements
+
+class BlockedPageError(Exception):
+    """The response is a CAPTCHA or consent page rather than flight results; it must not be cached as an empty result."""
+
+def extract_flight_data(html_content, origin, destination, date_str, encoding='utf-8'):
+    """
+    Extract flight information from the HTML content (bytes in the response's encoding).
     WARNING: These selectors are EXAMPLES and are VERY LIKELY TO BREAK.
     You MUST inspect the live Google Flights HTML and update them frequently.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
+    if not any(marker in html_content for marker in FLIGHT_PAGE_MARKERS):
+        raise BlockedPageError(f"No flight results markup in response ({len(html_content)} bytes), likely a CAPTCHA or consent page.")
+
+    # Lexbor reads node strings as strict UTF-8 whatever the page charset, so hand it text decoded with the
+    # response's encoding; errors='replace' also covers a multi-byte character cut by the trim or size cap.
+    tree = LexborHTMLParser(trim_to_flight_list(html_content).decode(encoding, errors='replace'))
     flights = []
     
     # --- SELECTOR WARNING ---
@@ -129,79 +365,93 @@ def extract_flight_data(html_content, origin, destination, date_str):
     # Attempt to find main flight result list items.
     # Common patterns: 'div[role="listitem"]', or specific classes Google might use for flight cards.
     # Sometimes results are in <ul> with <li> elements.
-    flight_containers = soup.select('div[jscontroller][role="listitem"], li[data-flight-id]') # Example, try to find unique attributes
+    flight_containers = tree.css(FLIGHT_CONTAINER_SELECTOR)
     
     if not flight_containers:
-        logger.warning(f"No flight containers found using primary selectors. HTML structure might have changed. Page content length: {len(html_content)}")
+        logger.warning("No flight containers found using primary selectors. HTML structure might have changed. Page content length: %s", len(html_content))
         # You could try other, broader selectors here as a fallback, but they might be less precise.
-        # e.g., flight_containers = soup.select('.some-flight-card-class') # If you find one
+        # e.g., flight_containers = tree.css('.some-flight-card-class') # If you find one
 
-    logger.info(f"Found {len(flight_containers)} potential flight containers.")
+    logger.info("Found %s potential flight containers.", len(flight_containers))
 
     for index, container in enumerate(flight_containers):
         airline, departure_time, arrival_time, duration, stops_str, price_str = None, None, None, None, "Nonstop", None
         try:
+            field_elements, field_attributes, time_elements = find_field_elements(container)
+
             # Airline: Often in an element with class related to airline name or in an aria-label.
             # Or look for an img tag with alt text containing the airline.
-            airline_element = container.select_one('div[aria-label*="airline"], span[class*="carrier"], div[class*="airline"]')
+            airline_element = field_elements.get('airline')
             if airline_element:
-                airline = airline_element.text.strip()
+                airline = airline_element.text().strip()
                 if not airline: # Try another common pattern
-                    img_alt_airline = container.select_one('img[alt*="airline"], img[aria-label*="airline"]')
-                    if img_alt_airline: airline = img_alt_airline.get('alt', '').replace('logo', '').strip()
-            if not airline: logger.debug(f"Container {index}: Airline not found.")
+                    img_alt_airline = field_elements.get('airline_img')
+                    if img_alt_airline: airline = (field_attributes['airline_img'].get('alt') or '').replace('logo', '').strip()
+            if not airline: logger.debug("Container %s: Airline not found.", index)
 
             # Times: Look for elements clearly indicating departure and arrival.
             # These are often within spans or divs with specific formatting or aria-labels.
             # Google might use a parent div for departure and another for arrival.
-            time_elements = container.select('span[aria-hidden="true"]') # This is a common pattern for visible text
             actual_times = []
             for el in time_elements:
-                if re.match(r'^\d{1,2}:\d{2}\s*(?:AM|PM)?$', el.text.strip()):
-                    actual_times.append(el.text.strip())
+                el_text = el.text().strip()
+                if TIME_RE.match(el_text):
+                    actual_times.append(el_text)
             
             if len(actual_times) >= 2:
                 departure_time = actual_times[0]
                 arrival_time = actual_times[1] # Assuming order, this might be wrong for multi-leg.
             else: # Fallback based on aria-labels
-                dep_el = container.select_one('div[aria-label*="Departs at"], span[aria-label*="Departs at"]')
-                if dep_el: departure_time = re.search(r'(\d{1,2}:\d{2}\s*(?:AM|PM)?)', dep_el.get('aria-label','')).group(1) if dep_el.get('aria-label') else dep_el.text.strip()
-
-                arr_el = container.select_one('div[aria-label*="Arrives at"], span[aria-label*="Arrives at"]')
-                if arr_el: arrival_time = re.search(r'(\d{1,2}:\d{2}\s*(?:AM|PM)?)', arr_el.get('aria-label','')).group(1) if arr_el.get('aria-label') else arr_el.text.strip()
-
-            if not departure_time: logger.debug(f"Container {index}: Departure time not found.")
-            if not arrival_time: logger.debug(f"Container {index}: Arrival time not found.")
+                dep_el = field_elements.get('departs')
+                if dep_el:
+                    dep_label = field_attributes['departs'].get('aria-label')
+                    if dep_label:
+                        dep_match = TIME_EXTRACT_RE.search(dep_label)
+                        if dep_match: departure_time = dep_match.group(1)
+                    else:
+                        departure_time = dep_el.text().strip()
+
+                arr_el = field_elements.get('arrives')
+                if arr_el:
+                    arr_label = field_attributes['arrives'].get('aria-label')
+                    if arr_label:
+                        arr_match = TIME_EXTRACT_RE.search(arr_label)
+                        if arr_match: arrival_time = arr_match.group(1)
+                    else:
+                        arrival_time = arr_el.text().strip()
+
+            if not departure_time: logger.debug("Container %s: Departure time not found.", index)
+            if not arrival_time: logger.debug("Container %s: Arrival time not found.", index)
 
 
             # Duration: Often explicitly stated.
-            duration_element = container.select_one('div[aria-label*="duration"], span[aria-label*="duration"]')
+            duration_element = field_elements.get('duration')
             if duration_element:
-                duration_match = re.search(r'(\d+h\s*\d*m?)', duration_element.get('aria-label', '') or duration_element.text)
+                duration_match = DURATION_RE.search(field_attributes['duration'].get('aria-label') or duration_element.text())
                 if duration_match: duration = duration_match.group(1)
-            if not duration: logger.debug(f"Container {index}: Duration not found.")
+            if not duration: logger.debug("Container %s: Duration not found.", index)
 
             # Stops: Look for "Nonstop", "1 stop", "2 stops".
-            stops_element = container.select_one('span[aria-label*="stop"], div[aria-label*="stop"], span[class*="stops"]')
+            stops_element = field_elements.get('stops')
             if stops_element:
-                stops_text_content = (stops_element.get('aria-label', '') or stops_element.text).lower()
+                stops_text_content = (field_attributes['stops'].get('aria-label') or stops_element.text()).lower()
                 if "nonstop" in stops_text_content:
                     stops_str = "Nonstop"
                 else:
-                    stops_match = re.search(r'(\d+)\s*stop(s)?', stops_text_content)
+                    stops_match = STOPS_RE.search(stops_text_content)
                     if stops_match:
                         stops_str = f"{stops_match.group(1)} stop{'s' if int(stops_match.group(1)) > 1 else ''}"
-            if stops_str == "Nonstop" and not stops_element: logger.debug(f"Container {index}: Stops element not found, defaulted to Nonstop.")
+            if stops_str == "Nonstop" and not stops_element: logger.debug("Container %s: Stops element not found, defaulted to Nonstop.", index)
 
 
             # Price: Often in an element with aria-label containing currency or a specific class.
-            price_element = container.select_one('div[aria-label*="$"], span[aria-label*="$"], div[class*="price"]')
+            price_element = field_elements.get('price')
             if price_element:
-                price_text_content = price_element.get('aria-label', '') or price_element.text
-                price_match = re.search(r'\$(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', price_text_content)
+                price_text_content = field_attributes['price'].get('aria-label') or price_element.text()
+                price_match = PRICE_RE.search(price_text_content)
                 if price_match:
                     price_str = f"${price_match.group(1)}"
-            if not price_str: logger.debug(f"Container {index}: Price not found.")
+            if not price_str: logger.debug("Container %s: Price not found.", index)
 
             if airline and departure_time and arrival_time and duration and price_str:
                 flight_data = {
@@ -213,46 +463,151 @@ def extract_flight_data(html_content, origin, destination, date_str):
                     "price": price_str  # Will be parsed by frontend (e.g., "$100" to 100)
                 }
                 flights.append(flight_data)
-                logger.info(f"Successfully extracted flight: Airline: {airline}, Price: {price_str}")
+                logger.info("Successfully extracted flight: Airline: %s, Price: %s", airline, price_str)
             else:
-                logger.warning(f"Container {index}: Missing essential data. Airline: {airline}, Dep: {departure_time}, Arr: {arrival_time}, Dur: {duration}, Price: {price_str}. Skipping.")
+                logger.warning("Container %s: Missing essential data. Airline: %s, Dep: %s, Arr: %s, Dur: %s, Price: %s. Skipping.", index, airline, departure_time, arrival_time, duration, price_str)
                 # For debugging, log the container's HTML snippet if data is missing
-                # logger.debug(f"Container HTML for missing data (index {index}):\n{container.prettify()[:1000]}\n------------------")
+                # logger.debug(f"Container HTML for missing data (index {index}):\n{container.html[:1000]}\n------------------")
 
         except Exception as e:
-            logger.error(f"Error extracting data for one flight entry (index {index}): {str(e)}", exc_info=True)
-            # logger.debug(f"Problematic Container HTML (index {index}):\n{container.prettify()[:1000]}\n------------------")
+            # Every field lookup above is None-checked, so this only catches the unexpected; skip just this container
+            logger.error("Error extracting data for one flight entry (index %s): %s", index, e, exc_info=True)
+            # logger.debug(f"Problematic Container HTML (index {index}):\n{container.html[:1000]}\n------------------")
             continue
     
     if not flights and flight_containers:
-        logger.warning(f"Found {len(flight_containers)} containers but extracted 0 flights. Selectors for individual fields likely need update.")
+        logger.warning("Found %s containers but extracted 0 flights. Selectors for individual fields likely need update.", len(flight_containers))
     elif not flights and not flight_containers:
         logger.warning("No flight containers found AND no flights extracted. Check primary container selectors and page content.")
 
     return flights
 
+def extract_flight_data_cached(html_content, origin, destination, date_str, encoding='utf-8'):
+    content_hasher = hashlib.blake2b(html_content, digest_size=16)
+    content_hasher.update(encoding.encode()) # The same bytes decode differently under another charset
+    content_hash = content_hasher.hexdigest()
+    with parse_cache_lock:
+        flights = parse_cache.get(content_hash)
+        if flights is not None:
+            parse_cache.move_to_end(content_hash)
+    if flights is not None:
+        logger.info("Parse cache hit for response %s. Skipping HTML parse.", content_hash)
+        return flights
+
+    redis_key = f"parsed:{content_hash}"
+    if redis_client is not None:
+        try:
+            cached = redis_client.get(redis_key)
+        except redis.RedisError as e:
+            logger.warning("Parse cache lookup failed for %s: %s", redis_key, e)
+            cached = None
+        if cached:
+            flights = orjson.loads(cached)
+            logger.info("Parse cache hit for response %s in Redis. Skipping HTML parse.", content_hash)
+
+    if flights is None:
+        flights = extract_flight_data(html_content, origin, destination, date_str, encoding)
+        if redis_client is not None:
+            try:
+                redis_client.setex(redis_key, PARSE_CACHE_TTL, orjson.dumps(flights))
+            except redis.RedisError as e:
+                logger.warning("Parse cache store failed for %s: %s", redis_key, e)
+
+    with parse_cache_lock:
+        parse_cache[content_hash] = flights
+        parse_cache.move_to_end(content_hash)
+        if len(parse_cache) > PARSE_CACHE_SIZE:
+            parse_cache.popitem(last=False)
+    return flights
+
+def build_cache_key(origin, destination, date_str, return_date_str=None, adults=1):
+    # Hash the serialized tuple: origin and destination are free-form, so joining them with a separator
+    # would let e.g. ("A:B", "C") and ("A", "B:C") share an entry
+    query = orjson.dumps([origin, destination, date_str, return_date_str, adults])
+    return f"flights:{hashlib.blake2b(query, digest_size=16).hexdigest()}"
+
+def get_cached_result(cache_key):
+    with result_cache_lock:
+        entry = result_cache.get(cache_key)
+    if entry is not None or redis_client is None:
+        return entry and entry[1]
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(cache_key)
+        pipe.pttl(cache_key)
+        cached, remaining_ms = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning("Cache lookup failed for %s: %s", cache_key, e)
+        return None
+    if not cached:
+        return None
+    result = orjson.loads(cached)
+    if "error" not in result and remaining_ms > 0:
+        with result_cache_lock:
+            result_cache[cache_key] = (time.monotonic() + remaining_ms / 1000, result)
+    return result
+
+def cache_result(cache_key, result):
+    if "error" not in result:
+        with result_cache_lock:
+            result_cache[cache_key] = (time.monotonic() + CACHE_TTL, result)
+    if redis_client is None:
+        return
+    ttl = ERROR_CACHE_TTL if "error" in result else CACHE_TTL
+    try:
+        redis_client.setex(cache_key, ttl, orjson.dumps(result))
+    except redis.RedisError as e:
+        logger.warning("Cache store failed for %s: %s", cache_key, e)
+
 def scrape_flights(origin, destination, date_str, return_date_str=None, adults=1):
-    logger.info(f"Attempting to scrape flights: {origin} to {destination} on {date_str}, Return: {return_date_str}, Adults: {adults}")
-    
-    enforce_rate_limit()
+    cache_key = build_cache_key(origin, destination, date_str, return_date_str, adults)
+    cached_result = get_cached_result(cache_key)
+    if cached_result is not None:
+        logger.info("Cache hit for %s. Skipping scrape.", cache_key)
+        return cached_result
+
+    result = fetch_flights(origin, destination, date_str, return_date_str, adults)
+    cache_result(cache_key, result)
+    return result
+
+def read_response_body(response):
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > MAX_RESPONSE_BYTES:
+            logger.warning("Response exceeded %s bytes. Parsing only the first %s.", MAX_RESPONSE_BYTES, MAX_RESPONSE_BYTES)
+            break
+    response.close() # Drops the connection instead of draining it if we stopped early
+    return b''.join(chunks)[:MAX_RESPONSE_BYTES]
+
+def fetch_flights(origin, destination, date_str, return_date_str=None, adults=1):
+    logger.info("Attempting to scrape flights: %s to %s on %s, Return: %s, Adults: %s", origin, destination, date_str, return_date_str, adults)
     
     url = build_search_url(origin, destination, date_str, return_date_str, adults)
     
+    enforce_rate_limit(urlsplit(url).hostname)
+    
     try:
         headers = get_headers()
-        logger.info(f"Requesting URL: {url}")
-        response = requests.get(url, headers=headers, timeout=20) # timeout
+        logger.info("Requesting URL: %s", url)
+        response = SESSION.get(url, headers=headers, timeout=20, stream=True) # timeout; per-request headers keep User-Agent rotation
         
         response.raise_for_status() # Will raise an HTTPError if the HTTP request returned an unsuccessful status code
 
+        # Read the body as bytes and decode only the trimmed flight list later, skipping requests' charset detection
+        html_content = read_response_body(response)
+        encoding = response.encoding or 'utf-8' # From the Content-Type charset, as response.text would use
+
         # For debugging, save the HTML content
-        # with open(f"google_flights_response_{origin}_{destination}_{date_str}.html", "w", encoding="utf-8") as f:
-        #    f.write(response.text)
+        # with open(f"google_flights_response_{origin}_{destination}_{date_str}.html", "wb") as f:
+        #    f.write(html_content)
         # logger.info("Saved HTML response for debugging.")
 
-        flights = extract_flight_data(response.text, origin, destination, date_str)
+        flights = extract_flight_data_cached(html_content, origin, destination, date_str, encoding)
         
-        logger.info(f"Scraping complete for {origin}-{destination} on {date_str}. Found {len(flights)} flights.")
+        logger.info("Scraping complete for %s-%s on %s. Found %s flights.", origin, destination, date_str, len(flights))
         return {
             "origin": origin,
             "destination": destination,
@@ -263,55 +618,155 @@ def scrape_flights(origin, destination, date_str, return_date_str=None, adults=1
             "results_count": len(flights)
         }
         
+    except BlockedPageError as e:
+        logger.error("Blocked fetching Google Flights page: %s URL: %s", e, url)
+        return {"error": "Google Flights returned a CAPTCHA or consent page instead of results. Access may be blocked."}
     except requests.exceptions.HTTPError as e:
-        logger.error(f"HTTP error fetching Google Flights page: {e}. Status: {e.response.status_code}. URL: {url}")
-        logger.error(f"Response content (first 500 chars): {e.response.text[:500]}")
+        logger.error("HTTP error fetching Google Flights page: %s. Status: %s. URL: %s", e, e.response.status_code, url)
+        logger.error("Response content (first 500 chars): %s", e.response.text[:500])
         return {"error": f"Failed to fetch data from Google Flights (HTTP {e.response.status_code}). Access may be blocked or page structure changed."}
     except requests.exceptions.RequestException as e:
-        logger.error(f"Request error fetching Google Flights page: {e}. URL: {url}")
+        logger.error("Request error fetching Google Flights page: %s. URL: %s", e, url)
         return {"error": f"Network request error when trying to reach Google Flights: {str(e)}"}
     except Exception as e:
-        logger.exception(f"An unexpected error occurred during the scraping process for {url}")
+        logger.exception("An unexpected error occurred during the scraping process for %s", url)
         return {"error": f"An unexpected critical error occurred during scraping: {str(e)}"}
 
-@app.route('/api/search', methods=['GET'])
-def search_flights_api():
-    origin = request.args.get('origin')
-    destination = request.args.get('destination')
-    date_str = request.args.get('date') # Expects YYYY-MM-DD from frontend
-    return_date_str = request.args.get('return_date') # Optional
-    adults_str = request.args.get('adults', '1')
-
-    if not all([origin, destination, date_str]):
-        logger.warning("API /api/search: Missing required parameters.")
-        return jsonify({"error": "Missing required parameters: origin, destination, and date are required."}), 400
-    
-    try:
-        # Validate date format (simple check)
-        datetime.strptime(date_str, '%Y-%m-%d')
-        if return_date_str:
-            datetime.strptime(return_date_str, '%Y-%m-%d')
-    except ValueError:
-        logger.warning(f"API /api/search: Invalid date format. Date: {date_str}, Return Date: {return_date_str}")
-        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD."}), 400
+def parse_search_params(params, endpoint):
+    """
+    Validate search parameters from the query string or a batch entry.
+    Returns ((origin, destination, date_str, return_date_str, adults), None) or (None, error_message).
+    """
+    origin = params.get('origin')
+    destination = params.get('destination')
+    date_str = params.get('date') # Expects YYYY-MM-DD from frontend
+    return_date_str = params.get('return_date') or None # Optional; empty means one-way
+    adults_str = params.get('adults', '1')
+
+    # One canonical spelling, so the cache key, the Google query and the echoed result all agree
+    if isinstance(origin, str): origin = origin.strip().upper()
+    if isinstance(destination, str): destination = destination.strip().upper()
+
+    if not (origin and destination and date_str):
+        logger.warning("API %s: Missing required parameters.", endpoint)
+        return None, "Missing required parameters: origin, destination, and date are required."
+    if not all(isinstance(value, str) for value in (origin, destination, date_str)):
+        logger.warning("API %s: Non-string origin, destination or date.", endpoint)
+        return None, "Invalid parameters: origin, destination, and date must be strings."
 
     try:
+        if isinstance(adults_str, (bool, float)): # JSON batch entries: only whole numbers or numeric strings
+            raise TypeError(adults_str)
         adults = int(adults_str)
         if adults < 1:
             raise ValueError("Number of adults must be at least 1.")
-    except ValueError:
-        logger.warning(f"API /api/search: Invalid number of adults: {adults_str}")
-        return jsonify({"error": "Invalid number of adults. Must be a positive integer."}), 400
+    except (ValueError, TypeError):
+        logger.warning("API %s: Invalid number of adults: %s", endpoint, adults_str)
+        return None, "Invalid number of adults. Must be a positive integer."
+
+    try:
+        # Dates stay strings from here on; check the shape, then that it's a real calendar date
+        for value in (date_str, return_date_str) if return_date_str else (date_str,):
+            if not DATE_RE.fullmatch(value):
+                raise ValueError(value)
+            date.fromisoformat(value)
+    except (ValueError, TypeError):
+        logger.warning("API %s: Invalid date format. Date: %s, Return Date: %s", endpoint, date_str, return_date_str)
+        return None, "Invalid date format. Use YYYY-MM-DD."
+
+    return (origin, destination, date_str, return_date_str, adults), None
+
+def enqueue_scrape(query):
+    """Queue a scrape for a parsed query tuple; the result is polled via /api/result/<job_id>."""
+    job = job_queue.enqueue(scrape_flights, *query, job_timeout=JOB_TIMEOUT, result_ttl=CACHE_TTL)
+    logger.info("Enqueued scrape job %s for %s", job.id, query)
+    return job
 
-    logger.info(f"API /api/search request: O={origin}, D={destination}, Date={date_str}, Return={return_date_str}, Adults={adults}")
+@app.route('/api/search', methods=['GET'])
+def search_flights_api():
+    query, error = parse_search_params(request.args, '/api/search')
+    if error:
+        return jsonify({"error": error}), 400
+    origin, destination, date_str, return_date_str, adults = query
+
+    logger.info("API /api/search request: O=%s, D=%s, Date=%s, Return=%s, Adults=%s", origin, destination, date_str, return_date_str, adults)
     
-    result = scrape_flights(origin, destination, date_str, return_date_str, adults)
+    # Cache hits are answered synchronously; with background jobs enabled, misses are scraped
+    # in the background and polled via /api/result/<job_id>
+    cached_result = get_cached_result(build_cache_key(origin, destination, date_str, return_date_str, adults))
+    if cached_result is not None:
+        result = cached_result
+    elif job_queue is not None:
+        job = enqueue_scrape(query)
+        return jsonify({"job_id": job.id, "status": "queued"}), 202
+    else:
+        result = scrape_flights(origin, destination, date_str, return_date_str, adults)
     
     if "error" in result:
         # Error message is already logged by scrape_flights
         return jsonify(result), 500 # Propagate error from scraper
             
-    return jsonify(result)
+    response = jsonify(result)
+    response.headers['X-Cache'] = 'HIT' if cached_result is not None else 'MISS'
+    return response
+
+@app.route('/api/search_batch', methods=['POST'])
+def search_flights_batch_api():
+    payload = request.get_json(silent=True)
+    raw_queries = payload.get('queries') if isinstance(payload, dict) else None
+    if not isinstance(raw_queries, list) or not raw_queries:
+        logger.warning("API /api/search_batch: Missing queries list.")
+        return jsonify({"error": "Request body must be JSON with a non-empty 'queries' list."}), 400
+    if len(raw_queries) > MAX_BATCH_QUERIES:
+        logger.warning("API /api/search_batch: Too many queries (%s).", len(raw_queries))
+        return jsonify({"error": f"Too many queries. At most {MAX_BATCH_QUERIES} are allowed per batch."}), 400
+
+    queries = []
+    for index, raw_query in enumerate(raw_queries):
+        query, error = parse_search_params(raw_query if isinstance(raw_query, dict) else {}, '/api/search_batch')
+        if error:
+            return jsonify({"error": f"Query {index}: {error}"}), 400
+        queries.append(query)
+
+    logger.info("API /api/search_batch request: %s queries", len(queries))
+
+    if job_queue is not None:
+        # As in /api/search: cache hits are returned inline, misses are queued and each entry carries its job_id
+        results = []
+        for query in queries:
+            cached_result = get_cached_result(build_cache_key(*query))
+            results.append(cached_result if cached_result is not None else {"job_id": enqueue_scrape(query).id, "status": "queued"})
+        status = 202 if any("job_id" in result for result in results) else 200
+        return jsonify({"results": results, "results_count": len(results)}), status
+
+    # Network latency dominates, so the batch completes in roughly the time of its slowest scrape
+    with ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(queries))) as executor:
+        results = list(executor.map(lambda query: scrape_flights(*query), queries))
+
+    return jsonify({"results": results, "results_count": len(results)})
+
+@app.route('/api/result/<job_id>', methods=['GET'])
+def search_result_api(job_id):
+    if job_queue is None:
+        return jsonify({"error": "Background jobs are not enabled. Results are returned directly by /api/search."}), 404
+
+    try:
+        job = Job.fetch(job_id, connection=job_queue.connection)
+    except NoSuchJobError:
+        logger.warning("API /api/result: Unknown job id %s", job_id)
+        return jsonify({"error": "Unknown or expired job id."}), 404
+
+    status = job.get_status()
+    if status == JobStatus.FINISHED:
+        result = job.return_value()
+        if "error" in result:
+            return jsonify(result), 500
+        return jsonify(result)
+    if status in (JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+        logger.error("API /api/result: Job %s ended with status %s", job_id, status.value)
+        return jsonify({"error": f"Scrape job {status.value}."}), 500
+
+    return jsonify({"job_id": job.id, "status": status.value}), 202
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -320,6 +775,9 @@ def health_check():
 if __name__ == "__main__":
     # For local development:
     # Ensure Flask-CORS is installed: pip install Flask-CORS
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Set FLASK_DEBUG=1 for the debugger and reloader; never enable it on a public host
+    app.run(host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1')
     # For Render.com, your Procfile would use gunicorn, e.g.:
-    # web: gunicorn app:app  (if your file is named app.py)
+    # web: gunicorn -c gunicorn.conf.py app:app -k gevent --workers 4 --worker-connections 500 --preload  (if your file is named app.py)
+    # gunicorn.conf.py monkey-patches for gevent before app.py is imported; the gevent worker then makes the
+    # rate-limit sleeps and Google Flights requests cooperative, so one worker keeps serving other requests while a scrape is waiting.
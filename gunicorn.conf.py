@@ -0,0 +1,6 @@
+# Gunicorn settings for the web service; gunicorn loads this file before importing app.py, even with --preload.
+# Patch blocking stdlib calls (sockets, time.sleep, threading) before the app imports them, so rate-limit sleeps
+# and Google Flights requests yield to other requests in the gevent workers. app.py itself is left unpatched,
+# so the RQ worker and `python app.py` import it as plain threaded code.
+from gevent import monkey
+monkey.patch_all()
@@ -0,0 +1,110 @@
+"""
+Extraction checks against a saved Google Flights results page (tests/fixtures/flights_page.html).
+Run with: python -m unittest discover -s . -p "test_*.py"  (or pytest)
+"""
+import os
+import re
+import unittest
+
+from selectolax.lexbor import LexborHTMLParser
+
+import app
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'flights_page.html')
+
+EXPECTED_FLIGHTS = [
+    {"airline": "Delta", "departure_time": "8:05 AM", "arrival_time": "11:20 AM", "duration": "3h 15m", "stops": "Nonstop", "price": "$1,234"},
+    {"airline": "United", "departure_time": "9:00 PM", "arrival_time": "6:10 AM", "duration": "6h 10m", "stops": "1 stop", "price": "$432"},
+    {"airline": "JetBlue airline", "departure_time": "6:45 AM", "arrival_time": "2:05 PM", "duration": "7h 20m", "stops": "2 stops", "price": "$89"},
+    {"airline": "Aerom\u00e9xico", "departure_time": "10:30", "arrival_time": "14:55", "duration": "4h 25m", "stops": "Nonstop", "price": "$310"},
+    {"airline": "American", "departure_time": "1:15 PM", "arrival_time": "4:40 PM", "duration": "3h 25m", "stops": "1 stop", "price": "$1,050.50"},
+    {"airline": "Frontier", "departure_time": "5:50 AM", "arrival_time": "8:05 AM", "duration": "2h 15m", "stops": "3 stops", "price": "$199"},
+]
+
+
+def baseline_extract(html_content):
+    """The original per-field selectors: one css_first() per field over the untrimmed page."""
+    flights = []
+    for container in LexborHTMLParser(html_content).css('div[jscontroller][role="listitem"], li[data-flight-id]'):
+        airline, departure_time, arrival_time, duration, stops_str, price_str = None, None, None, None, "Nonstop", None
+        airline_element = container.css_first('div[aria-label*="airline"], span[class*="carrier"], div[class*="airline"]')
+        if airline_element:
+            airline = airline_element.text().strip()
+            if not airline:
+                img_alt_airline = container.css_first('img[alt*="airline"], img[aria-label*="airline"]')
+                if img_alt_airline: airline = (img_alt_airline.attributes.get('alt') or '').replace('logo', '').strip()
+
+        actual_times = [el.text().strip() for el in container.css('span[aria-hidden="true"]')
+                        if re.match(r'^\d{1,2}:\d{2}\s*(?:AM|PM)?$', el.text().strip())]
+        if len(actual_times) >= 2:
+            departure_time, arrival_time = actual_times[0], actual_times[1]
+        else:
+            dep_el = container.css_first('div[aria-label*="Departs at"], span[aria-label*="Departs at"]')
+            if dep_el: departure_time = re.search(r'(\d{1,2}:\d{2}\s*(?:AM|PM)?)', dep_el.attributes['aria-label']).group(1)
+            arr_el = container.css_first('div[aria-label*="Arrives at"], span[aria-label*="Arrives at"]')
+            if arr_el: arrival_time = re.search(r'(\d{1,2}:\d{2}\s*(?:AM|PM)?)', arr_el.attributes['aria-label']).group(1)
+
+        duration_element = container.css_first('div[aria-label*="duration"], span[aria-label*="duration"]')
+        if duration_element:
+            duration_match = re.search(r'(\d+h\s*\d*m?)', duration_element.attributes.get('aria-label') or duration_element.text())
+            if duration_match: duration = duration_match.group(1)
+
+        stops_element = container.css_first('span[aria-label*="stop"], div[aria-label*="stop"], span[class*="stops"]')
+        if stops_element:
+            stops_text_content = (stops_element.attributes.get('aria-label') or stops_element.text()).lower()
+            if "nonstop" not in stops_text_content:
+                stops_match = re.search(r'(\d+)\s*stop(s)?', stops_text_content)
+                if stops_match:
+                    stops_str = f"{stops_match.group(1)} stop{'s' if int(stops_match.group(1)) > 1 else ''}"
+
+        price_element = container.css_first('div[aria-label*="$"], span[aria-label*="$"], div[class*="price"]')
+        if price_element:
+            price_match = re.search(r'\$(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', price_element.attributes.get('aria-label') or price_element.text())
+            if price_match: price_str = f"${price_match.group(1)}"
+
+        if airline and departure_time and arrival_time and duration and price_str:
+            flights.append({"airline": airline, "departure_time": departure_time, "arrival_time": arrival_time,
+                            "duration": duration, "stops": stops_str, "price": price_str})
+    return flights
+
+
+class ExtractFlightDataTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(FIXTURE_PATH, 'rb') as f:
+            cls.page = f.read()
+
+    def extract(self, html_content, encoding='utf-8'):
+        return app.extract_flight_data(html_content, 'JFK', 'LAX', '2026-11-01', encoding)
+
+    def test_saved_page(self):
+        self.assertEqual(self.extract(self.page), EXPECTED_FLIGHTS)
+
+    def test_matches_baseline_selectors(self):
+        # FIELD_SELECTOR + FIELD_RULES dispatch and trimming must pick the same elements as the per-field selectors
+        self.assertEqual(self.extract(self.page), baseline_extract(self.page))
+
+    def test_trim_keeps_every_container(self):
+        trimmed = app.trim_to_flight_list(self.page)
+        self.assertLess(len(trimmed), len(self.page) // 4)
+        self.assertEqual(len(LexborHTMLParser(trimmed).css(app.FLIGHT_CONTAINER_SELECTOR)),
+                         len(LexborHTMLParser(self.page).css(app.FLIGHT_CONTAINER_SELECTOR)))
+
+    def test_long_last_card_is_kept_whole(self):
+        # Pad the last card well past any fixed trim margin, ahead of its price element
+        padding = b'<span class="seat-map">' + b'x' * 200000 + b'</span>'
+        page = self.page.replace(b'<span aria-label="$199">', padding + b'<span aria-label="$199">')
+        self.assertEqual(self.extract(page), EXPECTED_FLIGHTS)
+
+    def test_undecodable_card_only_skips_itself(self):
+        page = self.page.replace('Operated by Delta'.encode(), 'Opéré par Delta'.encode('latin-1'), 1)
+        self.assertEqual(self.extract(page)[1:], EXPECTED_FLIGHTS[1:])
+        self.assertEqual([f["airline"] for f in self.extract(page, 'ISO-8859-1')][:2], ["Delta", "United"])
+
+    def test_blocked_page_raises(self):
+        with self.assertRaises(app.BlockedPageError):
+            self.extract(b'<html><body><form action="/sorry/index">Our systems have detected unusual traffic</form></body></html>')
+
+
+if __name__ == '__main__':
+    unittest.main()